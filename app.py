@@ -1,11 +1,23 @@
 import os
+import ast
 import hmac
 import hashlib
-import subprocess
-import tempfile
+import sys
+import json
+import atexit
+import queue
 import shutil
-import stat
+import tempfile
+import select
+import subprocess
+import threading
 import logging
+from collections import OrderedDict, defaultdict, deque
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import requests
+from requests.adapters import HTTPAdapter
 from flask import Flask, request, jsonify, abort
 from dotenv import load_dotenv
 
@@ -15,111 +27,375 @@ load_dotenv()
 APP_ID = os.getenv("APP_ID")                        # GitHub App ID
 WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET")  # Webhook secret
 PRIVATE_KEY_PATH = os.getenv("PRIVATE_KEY_PATH")    # Path to your private key
+WEBHOOK_SECRET_BYTES = WEBHOOK_SECRET.encode() if WEBHOOK_SECRET else None
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")            # Optional token for private repos
+MAX_ERRORS = int(os.getenv("MAX_ERRORS", 1000))     # Results kept for /errors
+MAX_CONCURRENT_CLONES = int(os.getenv("MAX_CONCURRENT_CLONES", 4))
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", os.cpu_count()))
+RUN_TIMEOUT = 10                                    # Seconds a checked file may run
+REPO_CACHE_DIR = os.getenv("REPO_CACHE_DIR", os.path.expanduser("~/.cache/webhook-repos"))
+SYNTAX_CACHE_DIR = os.getenv("SYNTAX_CACHE_DIR", os.path.expanduser("~/.cache/webhook-syntax"))
+
+RAW_URL = "https://raw.githubusercontent.com/{repo}/{sha}/{path}"
+# Seconds per download of a file a checked script imports. The script's own
+# RUN_TIMEOUT is ticking meanwhile, so a slow fetch must not use it all up.
+IMPORT_FETCH_TIMEOUT = 2
 
 app = Flask(__name__)
-errors = []
+errors = deque(maxlen=MAX_ERRORS)  # oldest results drop off
+
+# Background worker pool: webhook deliveries are acknowledged immediately and
+# the clone/check work runs here, off the request thread.
+executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Shared HTTP session so raw file fetches reuse keep-alive connections
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+if GITHUB_TOKEN:
+    session.headers["Authorization"] = f"token {GITHUB_TOKEN}"
+fetch_pool = ThreadPoolExecutor(max_workers=16)
+
+# Per-file checks run in parallel; each one mostly waits on a sandbox worker,
+# so there is no point having more threads than workers.
+check_pool = ThreadPoolExecutor(max_workers=SANDBOX_WORKERS)
+
+# One lock per repository URL so concurrent jobs never fetch into the same mirror
+repo_locks = defaultdict(threading.Lock)
+repo_locks_guard = threading.Lock()
+
+# Caps git transfers from GitHub across all jobs so a burst of deliveries does
+# not saturate the network or trip rate limits; file checks are not gated
+clone_semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_CLONES)
 
 # Logging Setup
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
 #Syntax Checker
-def check_syntax(file_path):
+# Sources are raw bytes straight from git or HTTP; the parser applies any
+# PEP 263 coding declaration itself.
+def parse_check(code):
     try:
-        with open(file_path, "r") as f:
-            code = f.read()
-        compile(code, file_path, 'exec')  # Python syntax validation
-        return None
+        ast.parse(code)  # Parse only, no bytecode generation
+        return ""
     except SyntaxError as e:
-        return f"Syntax Error in {file_path} at line {e.lineno}: {e.msg}"
+        return f"{e.lineno}\n{e.msg}"
 
-#Runtime Checker
-def run_file(file_path):
+# Results depend only on the source and interpreter version, so they are
+# cached on disk by a hash of those two, with an in-memory LRU in front.
+# A cache file holds "<line>\n<message>", or nothing when the source parses.
+SYNTAX_MEMO_SIZE = 8192
+syntax_memo = OrderedDict()  # 16-byte digest -> result; never holds sources
+syntax_memo_lock = threading.Lock()
+
+def syntax_result(code):
+    digest = hashlib.blake2b(sys.version.encode() + b"\0" + code, digest_size=16).digest()
+    with syntax_memo_lock:
+        if digest in syntax_memo:
+            syntax_memo.move_to_end(digest)
+            return syntax_memo[digest]
+
+    result = disk_syntax_result(digest.hex(), code)
+    with syntax_memo_lock:
+        syntax_memo[digest] = result
+        if len(syntax_memo) > SYNTAX_MEMO_SIZE:
+            syntax_memo.popitem(last=False)
+    return result
+
+def disk_syntax_result(digest, code):
+    cache_dir = os.path.join(SYNTAX_CACHE_DIR, digest[:2])
+    cache_path = os.path.join(cache_dir, digest)
     try:
-        result = subprocess.run(
-            ["python", file_path],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        if result.returncode != 0:
-            return f"Runtime error in {file_path}:\n{result.stderr.strip()}"
-        if result.stdout.strip():
-            return f"Output from {file_path}:\n{result.stdout.strip()}"
+        with open(cache_path, "r") as f:
+            return f.read()
+    except OSError:
+        pass
+
+    result = parse_check(code)
+    # Best effort: a full disk or read-only cache dir must not fail the check
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(result)
+            os.replace(tmp_path, cache_path)  # atomic, so readers never see a partial file
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logging.warning(f"Could not write syntax cache entry {cache_path}: {e}")
+    return result
+
+def check_syntax_source(code, file_path):
+    result = syntax_result(code)
+    if not result:
         return None
-    except subprocess.TimeoutExpired:
+    lineno, msg = result.split("\n", 1)
+    return f"Syntax Error in {file_path} at line {lineno}: {msg}"
+
+#Runtime Checker
+# Files are executed by a pool of long-lived sandbox_worker.py fork servers,
+# so a push pays interpreter startup once per worker instead of once per file.
+# The "sandbox" keeps runs from affecting each other; it is not a security
+# boundary. Checked code runs as the app's user, just as "python <file>" did,
+# and can read the app's files, environment (GITHUB_TOKEN, the webhook secret)
+# and /proc. Only install the app on repositories whose code you trust.
+SANDBOX_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+
+# Scratch space for checked scripts: RAM-backed /dev/shm when it is usable
+def tmp_root():
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return tempfile.gettempdir()
+
+# Every run gets a fresh directory under this root, removed when the run ends,
+# so files a checked script writes land on tmpfs and are not seen by the next
+SANDBOX_ROOT = tempfile.mkdtemp(prefix="sandbox-", dir=tmp_root())
+atexit.register(shutil.rmtree, SANDBOX_ROOT, ignore_errors=True)
+
+def start_sandbox():
+    # -I: isolated mode, so no user site-packages, PYTHON* env vars or app dir
+    # on sys.path
+    return subprocess.Popen(
+        [sys.executable, "-I", "-u", SANDBOX_SCRIPT, str(RUN_TIMEOUT), SANDBOX_ROOT],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=SANDBOX_ROOT
+    )
+
+sandbox_pool = queue.Queue()
+for _ in range(SANDBOX_WORKERS):
+    sandbox_pool.put(start_sandbox())
+
+# Answer a sandboxed import: the first candidate path the checked commit has
+def import_response(candidates, load):
+    for index, code in enumerate(load(candidates)):
+        if code is not None:
+            return f"={index} {len(code)}\n".encode() + code
+    return b"=-1\n"
+
+# load(paths) returns the bytes of other files in the same commit (None for
+# each one that is missing), so checked files can import their sibling modules
+def run_source(code, file_path, load):
+    worker = sandbox_pool.get()
+    timed_out = False
+    try:
+        worker.stdin.write(f"{len(code)} {file_path}\n".encode() + code)
+        worker.stdin.flush()
+        while True:
+            # The worker kills runs that pass RUN_TIMEOUT itself; this is only
+            # the backstop for a wedged worker.
+            ready, _, _ = select.select([worker.stdout], [], [], RUN_TIMEOUT + 5)
+            timed_out = not ready
+            line = b"" if timed_out else worker.stdout.readline()
+            if not line:
+                break
+            result = json.loads(line)
+            if "import" not in result:
+                break
+            worker.stdin.write(import_response(result["import"], load))
+            worker.stdin.flush()
+    except (OSError, ValueError):
+        line = b""
+    if not line:
+        worker.kill()
+        worker.wait()
+        sandbox_pool.put(start_sandbox())
+        if timed_out:
+            return f"Timeout while running {file_path} (possible infinite loop)"
+        return f"Runtime error in {file_path}:\nSandbox worker exited unexpectedly"
+    sandbox_pool.put(worker)
+
+    if result["status"] == "timeout":
         return f"Timeout while running {file_path} (possible infinite loop)"
+    if result["returncode"] != 0:
+        return f"Runtime error in {file_path}:\n{result['stderr'].strip()}"
+    if result["stdout"].strip():
+        return f"Output from {file_path}:\n{result['stdout'].strip()}"
+    return None
+
+# Single File Check: returns (log level, message)
+def check_file(file_path, code, load):
+    if code is None:
+        return logging.WARNING, f"{file_path}: File not found in repo"
+    error = check_syntax_source(code, file_path)
+    if error:
+        return logging.ERROR, error
+    runtime_error = run_source(code, file_path, load)
+    if runtime_error:
+        return logging.ERROR, runtime_error
+    return logging.INFO, f"{file_path}: No errors"
+
+# Check files concurrently, then record the results in order from this thread
+def record(level, msg):
+    errors.append(msg)
+    logging.log(level, msg)
+
+def check_files(file_paths, sources, load):
+    for level, msg in check_pool.map(check_file, file_paths, sources, repeat(load)):
+        record(level, msg)
 
 #Verify Webhook Signature
 def verify_signature(payload, signature):
-    mac = hmac.new(WEBHOOK_SECRET.encode(), msg=payload, digestmod=hashlib.sha256)
-    expected = f"sha256={mac.hexdigest()}"
-    return hmac.compare_digest(expected, signature)
+    if WEBHOOK_SECRET_BYTES is None or not signature.startswith("sha256="):
+        return False
+    try:
+        received = bytes.fromhex(signature[len("sha256="):])
+    except ValueError:
+        return False
+    mac = hmac.new(WEBHOOK_SECRET_BYTES, msg=payload, digestmod=hashlib.sha256)
+    return hmac.compare_digest(mac.digest(), received)
+
+# Held by every git operation that writes into a repo's mirror
+def repo_lock(repo_url):
+    with repo_locks_guard:
+        return repo_locks[repo_url]
+
+# Persistent Bare Mirror: cloned once per repo URL, then only fetched
+def get_repo(repo_url, *refspecs):
+    path = os.path.join(REPO_CACHE_DIR, hashlib.sha1(repo_url.encode()).hexdigest() + ".git")
+    with repo_lock(repo_url), clone_semaphore:
+        if not os.path.isdir(path):
+            logging.info(f"Creating mirror of {repo_url} in {path}")
+            subprocess.run(
+                ["git", "clone", "--bare", "--filter=blob:none", "--no-tags", repo_url, path],
+                check=True
+            )
+        subprocess.run(
+            ["git", "-C", path, "fetch", "--prune", "--no-tags", "origin",
+             "+refs/heads/*:refs/heads/*", *refspecs],
+            check=True
+        )
+    return path
+
+# Python files in a commit, as (blob id, path) pairs. Diffing against the empty
+# tree lets git apply the *.py pathspec itself (ls-tree cannot glob), so
+# non-Python entries never reach Python.
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
 
-#Windows-Safe Cleanup
-def remove_readonly(func, path, _):
-    os.chmod(path, stat.S_IWRITE)
-    func(path)
+def list_python_blobs(repo, sha):
+    listing = subprocess.run(
+        ["git", "-C", repo, "diff-tree", "-r", "-z", "--no-renames",
+         EMPTY_TREE, sha, "--", "*.py"],
+        capture_output=True, check=True
+    ).stdout.decode()
+    fields = listing.split("\0")
+    blobs = []
+    for info, file_path in zip(fields[0::2], fields[1::2]):
+        # ":000000 <mode> <null oid> <oid> A"; skip symlinks and submodules
+        mode, oid = info.split()[1::2]
+        if mode in ("100644", "100755"):
+            blobs.append((oid, file_path))
+    return blobs
 
-def safe_rmtree(path):
-    if os.path.exists(path):
-        shutil.rmtree(path, onerror=remove_readonly)
+# Partial clone: download every missing blob we need in one fetch instead of
+# letting git lazily fetch them one at a time. Holds the repo's lock like
+# get_repo, so it never fetches into a mirror another job is updating.
+def prefetch_blobs(repo_url, repo, sha, oids):
+    with repo_lock(repo_url):
+        listing = subprocess.run(
+            ["git", "-C", repo, "rev-list", "--objects", "--missing=print", "--no-walk", sha],
+            capture_output=True, text=True, check=True
+        ).stdout
+        missing = {line[1:] for line in listing.splitlines() if line.startswith("?")}
+        wanted = missing.intersection(oids)
+        if wanted:
+            with clone_semaphore:
+                subprocess.run(
+                    ["git", "-C", repo, "-c", "fetch.negotiationAlgorithm=noop",
+                     "fetch", "origin", "--no-tags", "--no-write-fetch-head",
+                     "--recurse-submodules=no", "--filter=blob:none", "--stdin"],
+                    input="\n".join(wanted) + "\n", text=True, check=True
+                )
+
+# One long-lived "git cat-file --batch" process serves every blob of a check run
+def read_blobs(repo, oids):
+    proc = subprocess.Popen(
+        ["git", "-C", repo, "cat-file", "--batch"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    try:
+        for oid in oids:
+            proc.stdin.write(f"{oid}\n".encode())
+            proc.stdin.flush()
+            header = proc.stdout.readline().split()
+            if len(header) != 3:  # "<oid> missing"
+                yield None
+                continue
+            data = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)  # trailing newline after the contents
+            yield data
+    finally:
+        proc.stdin.close()
+        proc.wait()
 
 # Common repo check logic
-def run_checks_on_repo(temp_dir):
-    for root, _, files in os.walk(temp_dir):
-        for file in files:
-            if file.endswith(".py"):
-                abs_path = os.path.join(root, file)
-                error = check_syntax(abs_path)
-                if error:
-                    errors.append(error)
-                    logging.error(error)
-                else:
-                    runtime_error = run_file(abs_path)
-                    if runtime_error:
-                        errors.append(runtime_error)
-                        logging.error(runtime_error)
-                    else:
-                        msg = f"{file}: No errors"
-                        errors.append(msg)
-                        logging.info(msg)
+def run_checks_on_repo(repo_url, repo, sha):
+    blobs = list_python_blobs(repo, sha)
+    prefetch_blobs(repo_url, repo, sha, [oid for oid, _ in blobs])
+    file_paths = [file_path for _, file_path in blobs]
+    sources = list(read_blobs(repo, [oid for oid, _ in blobs]))
+    tree = dict(zip(file_paths, sources))  # every .py file, for sandbox imports
+    check_files(file_paths, sources, lambda paths: [tree.get(p) for p in paths])
+
+# Raw File Fetch: returns None when the file is not in the commit
+def fetch_file(repo, sha, file_path, timeout=10):
+    url = RAW_URL.format(repo=repo, sha=sha, path=quote(file_path))
+    response = session.get(url, timeout=timeout)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.content
 
 # Push Handler
 def handle_push(payload):
-    repo_url = payload["repository"]["clone_url"]
-    logging.info(f"Received push event from repo: {repo_url}")
+    repo = payload["repository"]["full_name"]
+    sha = payload["after"]
+    logging.info(f"Received push event from repo: {repo}")
 
-    temp_dir = tempfile.mkdtemp()
-    logging.info(f"Cloning repository into {temp_dir}")
-    subprocess.run(["git", "clone", repo_url, temp_dir], check=True)
+    if payload.get("deleted"):
+        logging.info(f"Skipping push that deleted {payload['ref']}")
+        return
 
+    # Net set of files the push leaves behind: each path is fetched once even
+    # if several commits touched it, and files deleted later are skipped.
+    touched = {}
     for commit in payload.get("commits", []):
         for file_path in commit.get("added", []) + commit.get("modified", []):
-            if file_path.endswith(".py"):
-                abs_path = os.path.join(temp_dir, file_path)
-                if os.path.exists(abs_path):
-                    error = check_syntax(abs_path)
-                    if error:
-                        errors.append(error)
-                        logging.error(error)
-                    else:
-                        runtime_error = run_file(abs_path)
-                        if runtime_error:
-                            errors.append(runtime_error)
-                            logging.error(runtime_error)
-                        else:
-                            msg = f"{file_path}: No errors"
-                            errors.append(msg)
-                            logging.info(msg)
-                else:
-                    msg = f"{file_path}: File not found in repo"
-                    errors.append(msg)
-                    logging.warning(msg)
-
-    logging.info(f"Cleaning up {temp_dir}")
-    safe_rmtree(temp_dir)
-
-    return jsonify({"status": "push checked", "errors_found": len(errors), "details": errors}), 200
+            touched[file_path] = True
+        for file_path in commit.get("removed", []):
+            touched.pop(file_path, None)
+    file_paths = [file_path for file_path in touched if file_path.endswith(".py")]
+    logging.info(f"Fetching {len(file_paths)} files from {repo}@{sha}")
+
+    # A failed download is reported against its own file; the rest still run
+    def fetch(file_path):
+        try:
+            return fetch_file(repo, sha, file_path), None
+        except requests.RequestException as e:
+            return None, f"{file_path}: Could not fetch file: {e}"
+
+    fetched = []
+    for file_path, (code, error) in zip(file_paths, fetch_pool.map(fetch, file_paths)):
+        if error:
+            record(logging.ERROR, error)
+        else:
+            fetched.append((file_path, code))
+
+    # Files the push did not touch are downloaded only if a checked file
+    # imports them: all candidates at once on fetch_pool, with a short timeout.
+    # A failed download counts as a missing module.
+    tree = dict(fetched)
+    def fetch_import(file_path):
+        try:
+            return fetch_file(repo, sha, file_path, timeout=IMPORT_FETCH_TIMEOUT)
+        except requests.RequestException:
+            return None
+    def load(file_paths):
+        missing = [file_path for file_path in file_paths if file_path not in tree]
+        tree.update(zip(missing, fetch_pool.map(fetch_import, missing)))
+        return [tree[file_path] for file_path in file_paths]
+
+    check_files([file_path for file_path, _ in fetched], [code for _, code in fetched], load)
 
 # Pull Request Handler
 def handle_pull_request(payload):
@@ -130,20 +406,23 @@ def handle_pull_request(payload):
     logging.info(f"Pull Request #{pr_number} {action} in {repo_url}")
 
     if action not in ["opened", "synchronize", "reopened"]:
-        return jsonify({"status": "skipped"}), 200
+        logging.info(f"Skipping pull request action: {action}")
+        return
 
-    temp_dir = tempfile.mkdtemp()
-    pr_branch = payload["pull_request"]["head"]["ref"]
+    head_sha = payload["pull_request"]["head"]["sha"]
+    pr_ref = f"refs/pull/{pr_number}/head"
 
-    logging.info(f"Cloning PR branch {pr_branch} into {temp_dir}")
-    subprocess.run(["git", "clone", "--branch", pr_branch, repo_url, temp_dir], check=True)
+    logging.info(f"Fetching PR head {head_sha}")
+    repo = get_repo(repo_url, f"+{pr_ref}:{pr_ref}")
 
-    run_checks_on_repo(temp_dir)
+    run_checks_on_repo(repo_url, repo, head_sha)
 
-    logging.info(f"Cleaning up {temp_dir}")
-    safe_rmtree(temp_dir)
-
-    return jsonify({"status": "PR checked", "errors_found": len(errors), "details": errors}), 200
+# Background Job Runner
+def run_in_background(handler, payload):
+    try:
+        handler(payload)
+    except Exception:
+        logging.exception(f"Background job {handler.__name__} failed")
 
 # Webhook Router
 @app.route("/webhook", methods=["POST"])
@@ -157,18 +436,25 @@ def webhook():
     payload = request.json
 
     if event == "push":
-        return handle_push(payload)
+        handler = handle_push
     elif event == "pull_request":
-        return handle_pull_request(payload)
+        handler = handle_pull_request
     else:
         return jsonify({"status": "ignored", "event": event}), 200
 
+    executor.submit(run_in_background, handler, payload)
+    return jsonify({"status": "queued", "event": event}), 202
+
 # Errors Page
 @app.route("/errors", methods=["GET"])
 def get_errors():
-    return jsonify(errors)
+    return jsonify(list(errors))
 
 # Run Flask
 if __name__ == "__main__":
     logging.info("Starting Flask GitHub App Listener on port 5000")
-    app.run(port=5000, debug=True)
+    # Deliveries are served on their own threads and only queue work, so one
+    # process handles bursts fine. The reloader is off: it would start a second
+    # process with its own sandbox pool. Under gunicorn use a single worker with
+    # threads (gunicorn -w 1 --threads 8 app:app) so /errors sees every result.
+    app.run(port=5000, debug=True, threaded=True, use_reloader=False)
@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import time
+import types
+import atexit
+import posixpath
+import importlib.abc
+import importlib.util
+import select
+import shutil
+import signal
+import tempfile
+import threading
+import traceback
+
+# Long-lived sandbox fork server used by app.py's runtime checker.
+# Requests on stdin:  "<size> <file path>\n" followed by <size> bytes of source
+# Replies on stdout:  one JSON line {"status": ok|timeout, "returncode", "stdout", "stderr"}
+# While a file runs, its imports of sibling modules are resolved through the
+# same pipes: the server writes {"import": [candidate paths]} and app.py answers
+# "=<index> <size>\n" plus the source, or "=-1\n" when none exist.
+#
+# The child never touches these pipes. It sends import requests over a private
+# pipe pair and the server relays them, so a checked file cannot write a reply
+# of its own or read another file's traffic.
+#
+# Every request is run in a freshly forked child, so nothing a checked file
+# does to the interpreter (builtins, sys.modules, cwd, signal handlers,
+# threads) leaks into the next one, while interpreter startup is still paid
+# only once per server.
+
+TIMEOUT = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+SCRATCH_ROOT = sys.argv[2] if len(sys.argv) > 2 else tempfile.gettempdir()
+OUTPUT_LIMIT = 8192  # Bytes of stdout/stderr kept per run
+
+# Marks package __path__ entries that live in the checked commit, not on disk
+REPO_PATH_PREFIX = "<repo>/"
+
+MAX_IMPORT_REQUEST = 65536  # Bytes; longer request lines from a child are dropped
+
+# Imports modules from the checked commit, asking the server for their source.
+# It sits at the end of sys.meta_path, after the standard library and
+# installed packages.
+class RepoImporter(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def __init__(self, base_dir, answers_in, requests_out):
+        self.base_dir = base_dir
+        self.answers_in = answers_in
+        self.requests_out = requests_out
+        self.sources = {}
+
+    def request(self, candidates):
+        self.requests_out.write(json.dumps({"import": candidates}) + "\n")
+        self.requests_out.flush()
+        index, _, size = self.answers_in.readline().decode()[1:].strip().partition(" ")
+        if int(index) < 0:
+            return None
+        return candidates[int(index)], self.answers_in.read(int(size))
+
+    def find_spec(self, fullname, path, target=None):
+        if path is None:
+            dirs = [self.base_dir]
+        else:
+            dirs = [entry[len(REPO_PATH_PREFIX):] for entry in path
+                    if entry.startswith(REPO_PATH_PREFIX)]
+        for directory in dirs:
+            stem = posixpath.join(directory, fullname.rpartition(".")[2])
+            found = self.request([stem + ".py", stem + "/__init__.py"])
+            if found:
+                origin, source = found
+                is_package = origin.endswith("/__init__.py")
+                spec = importlib.util.spec_from_loader(
+                    fullname, self, origin=origin, is_package=is_package
+                )
+                spec.has_location = True
+                if is_package:
+                    spec.submodule_search_locations = [REPO_PATH_PREFIX + stem]
+                self.sources[fullname] = source
+                return spec
+        return None
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        source = self.sources.pop(module.__spec__.name)
+        exec(compile(source, module.__spec__.origin, "exec"), module.__dict__)
+
+# Runs in the forked child; returns the exit code the interpreter would use
+def execute(source, file_path):
+    sys.argv = [file_path]
+    main_module = types.ModuleType("__main__")
+    main_module.__file__ = file_path
+    sys.modules["__main__"] = main_module
+    try:
+        exec(compile(source, file_path, "exec"), main_module.__dict__)
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException as e:
+        # Drop this frame so the traceback starts in the checked file
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        return 1
+
+def child(source, file_path, out_w, err_w, import_pipes, scratch_dir):
+    code = 1
+    try:
+        os.setpgid(0, 0)  # own process group, so a timeout kills its children too
+        os.chdir(scratch_dir)
+        os.dup2(out_w, 1)
+        os.dup2(err_w, 2)
+        os.close(out_w)
+        os.close(err_w)
+        # Like sys.path[0] for "python <file>": the file's own directory
+        answers_r, requests_w = import_pipes
+        sys.meta_path.append(RepoImporter(
+            posixpath.dirname(file_path), os.fdopen(answers_r, "rb"), os.fdopen(requests_w, "w")
+        ))
+        # An uncaught exception in a thread fails the run instead of only
+        # printing a traceback next to a clean exit status
+        thread_errors = []
+        def excepthook(args, default=threading.excepthook):
+            thread_errors.append(args.exc_type)
+            default(args)
+        threading.excepthook = excepthook
+
+        code = execute(source, file_path)
+        # Finish the way Py_FinalizeEx does: join non-daemon threads, then
+        # run atexit handlers
+        threading._shutdown()
+        atexit._run_exitfuncs()
+        if code == 0 and thread_errors:
+            code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code & 0xFF)
+
+# Forwards one import request from the child to app.py and returns the answer.
+# The request is rebuilt from validated fields, so whatever the child wrote,
+# app.py only ever sees a well-formed {"import": [...]} line from the server.
+def relay_import(line, channel):
+    requests_in, replies_out = channel
+    try:
+        candidates = json.loads(line)["import"]
+    except (ValueError, KeyError, TypeError):
+        return b"=-1\n"
+    if not (isinstance(candidates, list) and 0 < len(candidates) <= 2
+            and all(isinstance(c, str) for c in candidates)):
+        return b"=-1\n"
+    replies_out.write(json.dumps({"import": candidates}) + "\n")
+    replies_out.flush()
+    header = requests_in.readline()
+    index, _, size = header.decode()[1:].strip().partition(" ")
+    if int(index) < 0:
+        return header
+    return header + requests_in.read(int(size))
+
+# Reads both output pipes until the child exits or the deadline passes,
+# keeping at most OUTPUT_LIMIT bytes of each so a chatty script cannot balloon
+# memory, and relays the child's import requests in the meantime
+def collect(pid, out_r, err_r, requests_r, answers_w, channel):
+    deadline = time.monotonic() + TIMEOUT
+    output = {out_r: bytearray(), err_r: bytearray()}
+    open_fds = [out_r, err_r, requests_r]
+    request, answer = bytearray(), bytearray()
+
+    def pump(timeout):
+        writers = [answers_w] if answer else []
+        ready, writable, _ = select.select(open_fds, writers, [], timeout)
+        for fd in ready:
+            data = os.read(fd, 65536)
+            if not data:
+                open_fds.remove(fd)
+            elif fd == requests_r:
+                request.extend(data)
+                while b"\n" in request:
+                    line, _, rest = bytes(request).partition(b"\n")
+                    request[:] = rest
+                    answer.extend(relay_import(line, channel))
+                if len(request) > MAX_IMPORT_REQUEST:
+                    request.clear()
+            elif len(output[fd]) < OUTPUT_LIMIT:
+                output[fd] += data[:OUTPUT_LIMIT - len(output[fd])]
+        if writable:
+            try:
+                del answer[:os.write(answers_w, answer)]
+            except BlockingIOError:
+                pass
+            except BrokenPipeError:
+                answer.clear()
+        return ready
+
+    status = None
+    while status is None and time.monotonic() < deadline:
+        if open_fds or answer:
+            pump(min(deadline - time.monotonic(), 0.05))
+        else:
+            time.sleep(0.01)
+        finished, wait_status = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            status = wait_status
+
+    # Kill whatever is left of the process group: the child itself on timeout,
+    # or background processes it started that still hold the pipes
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+    timed_out = status is None
+    if timed_out:
+        _, status = os.waitpid(pid, 0)
+    if requests_r in open_fds:
+        open_fds.remove(requests_r)  # nobody is left to answer
+    answer.clear()
+    while open_fds and pump(0):
+        pass
+    return {
+        "status": "timeout" if timed_out else "ok",
+        "returncode": os.waitstatus_to_exitcode(status),
+        "stdout": output[out_r].decode("utf-8", errors="replace"),
+        "stderr": output[err_r].decode("utf-8", errors="replace"),
+    }
+
+def run(source, file_path, channel):
+    scratch_dir = tempfile.mkdtemp(prefix="run-", dir=SCRATCH_ROOT)
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    requests_r, requests_w = os.pipe()
+    answers_r, answers_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Leave the child nothing but its own pipes: the server's protocol
+        # channel is closed before any checked code runs
+        for f in channel:
+            f.close()
+        for fd in (out_r, err_r, requests_r, answers_w):
+            os.close(fd)
+        child(source, file_path, out_w, err_w, (answers_r, requests_w), scratch_dir)
+    for fd in (out_w, err_w, requests_w, answers_r):
+        os.close(fd)
+    os.set_blocking(answers_w, False)
+    try:
+        return collect(pid, out_r, err_r, requests_r, answers_w, channel)
+    finally:
+        for fd in (out_r, err_r, requests_r, answers_w):
+            os.close(fd)
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+def main():
+    # Keep private copies of the protocol pipes and point fds 0/1 at /dev/null
+    # so user code reading stdin or writing to fd 1 cannot corrupt the stream.
+    requests_in = os.fdopen(os.dup(0), "rb")
+    replies_out = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    channel = (requests_in, replies_out)
+
+    while True:
+        header = requests_in.readline()
+        if not header:
+            break
+        size, file_path = header.decode().rstrip("\n").split(" ", 1)
+        source = requests_in.read(int(size))
+        reply = run(source, file_path, channel)
+        replies_out.write(json.dumps(reply) + "\n")
+        replies_out.flush()
+
+if __name__ == "__main__":
+    main()